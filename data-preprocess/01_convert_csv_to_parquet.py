@@ -3,11 +3,16 @@
 
 from typing import Union, Tuple
 
+import os
 import time
 import pandas
 import geopandas
+import shapely
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import pyarrow.dataset as ds
 import pyarrow.compute as pc
 
@@ -24,6 +29,98 @@ output_data_dir = Path("processed-data/MRB")
 # make sure output directory exists
 output_data_dir.mkdir(exist_ok=True)
 
+# explicit formats for date columns that are not ISO 8601 strings.
+# all other date columns are parsed as ISO 8601.
+date_formats = {"year": "%Y"}
+
+
+def read_csv_table(path: Path, date_cols: list = []) -> pa.Table:
+    """
+    Reads a single CSV file into a PyArrow table and appends
+    a STREAM_ID column derived from the filename.
+
+    Arguments
+    =========
+    path: Path - The CSV file to read.
+    date_cols: list - A list of column names to read as strings so they can be parsed later.
+
+    Returns
+    =======
+    pyarrow.Table
+
+    """
+    # blank cells in string columns (e.g. the Flag_* columns and the dates)
+    # are read as null, matching the NaN that pandas.read_csv produced.
+    convert_options = pacsv.ConvertOptions(
+        column_types={col: pa.string() for col in date_cols},
+        strings_can_be_null=True,
+        quoted_strings_can_be_null=True,
+    )
+    table = pacsv.read_csv(path, convert_options=convert_options)
+    table = table.append_column(
+        "STREAM_ID", pa.array([path.stem] * table.num_rows, type=pa.large_string())
+    )
+
+    return table
+
+
+def read_csv_dir(input_data_dir: Path, date_cols: list = []) -> pa.Table:
+    """
+    Reads all CSV files in the input directory concurrently
+    and concatenates them into a single PyArrow table.
+
+    Arguments
+    =========
+    input_data_dir: str - The input directory containing the CSV files.
+    date_cols: list - A list of column names to parse as dates.
+
+    Returns
+    =======
+    pyarrow.Table
+
+    """
+    files = list(input_data_dir.glob("*.csv"))
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        tables = list(
+            executor.map(lambda f: read_csv_table(f, date_cols), files)
+        )
+
+    # files may infer different types for the same column (e.g. int vs double,
+    # or null for empty columns), so let arrow promote them to a common type.
+    table = pa.concat_tables(tables, promote_options="permissive")
+
+    return parse_date_columns(table, date_cols)
+
+
+def parse_date_columns(table: pa.Table, date_cols: list = []) -> pa.Table:
+    """
+    Converts string date columns to timestamps in a single pass
+    over the concatenated table.
+
+    Arguments
+    =========
+    table: pyarrow.Table - The table containing the date columns.
+    date_cols: list - A list of column names to parse as dates.
+
+    Returns
+    =======
+    pyarrow.Table
+
+    """
+    for col in date_cols:
+        if col not in table.column_names:
+            continue
+
+        fmt = date_formats.get(col)
+        if fmt is None:
+            parsed = pc.cast(table[col], pa.timestamp("ns"))
+        else:
+            parsed = pc.strptime(table[col], format=fmt, unit="ns")
+
+        table = table.set_column(table.schema.get_field_index(col), col, parsed)
+
+    return table
+
 
 def create_single_parquet(
     input_data_dir: Path,
@@ -33,7 +130,7 @@ def create_single_parquet(
 ):
     """
     Reads all CSV files in the input directory,
-    concatenates them into a single DataFrame,
+    concatenates them into a single PyArrow table,
     and saves it as a Parquet file.
 
     Arguments
@@ -41,25 +138,37 @@ def create_single_parquet(
     input_data_dir: str - The input directory containing the CSV files.
     output_filename: str - The filename for the output Parquet file.
     date_cols: list - A list of column names to parse as dates.
-    sort_by: str or None - The column name to sort the DataFrame by before saving
+    sort_by: str or None - The column name to sort the table by before saving
 
     Returns
     =======
     None
 
     """
-    dfs = []
-    for f in input_data_dir.glob("*.csv"):
-        df_temp = pandas.read_csv(f, parse_dates=date_cols)
-        df_temp["STREAM_ID"] = f.stem
-        dfs.append(df_temp)
-
-    df = pandas.concat(dfs)
+    table = read_csv_dir(input_data_dir, date_cols)
 
+    # cluster rows by gauge so that each row group covers only a few gauges
+    # and its min/max statistics can be used to skip it on filtered reads.
+    sort_keys = [("STREAM_ID", "ascending")]
     if sort_by is not None:
-        df.sort_values(by=sort_by, inplace=True)
+        sort_keys.append((sort_by, "ascending"))
+    table = table.sort_by(sort_keys)
 
-    df.to_parquet(output_filename, index=False)
+    # store STREAM_ID as a dictionary so that readers load it as integer
+    # codes into a small set of unique ids instead of one string per row.
+    table = table.set_column(
+        table.schema.get_field_index("STREAM_ID"),
+        "STREAM_ID",
+        pc.dictionary_encode(table["STREAM_ID"]),
+    )
+
+    pq.write_table(
+        table,
+        output_filename,
+        row_group_size=250_000,
+        write_statistics=True,
+        compression="zstd",
+    )
 
 
 def create_hive_parquet(
@@ -87,33 +196,18 @@ def create_hive_parquet(
 
     """
 
-    print("\n    Loading data csv data into Pandas...", end="", flush=True)
+    print("\n    Loading csv data into PyArrow table...", end="", flush=True)
     st = time.time()
-    dfs = []
-    for f in input_data_dir.glob("*.csv"):
-        df_temp = pandas.read_csv(f, parse_dates=date_cols)
-        df_temp["STREAM_ID"] = f.stem
-        if sort_by is not None:
-            df_temp.sort_values(by=sort_by, inplace=True)
-        dfs.append(df_temp)
-
-    df = pandas.concat(dfs)
-
-    #    df.to_parquet("hive_temp.parquet")
+    table = read_csv_dir(input_data_dir, date_cols)
     print(f"done [elapsed time: {time.time() - st:.2f} seconds]")
 
-    # convert the pandas dataframe to a pyarrow table
-    print("    Converting DataFrame into PyArrow table...", end="", flush=True)
-    st = time.time()
-    # table = pq.read_table("hive_temp.parquet")
-    table = pa.Table.from_pandas(df)
-    print(f"done [elapsed time: {time.time() - st:.2f} seconds]")
-
-    table = table.set_column(
-        table.schema.get_field_index("STREAM_ID"),
-        "STREAM_ID",
-        pc.cast(table["STREAM_ID"], pa.large_string()),
-    )
+    # sort once after concatenating. Grouping rows by STREAM_ID makes each
+    # partition a contiguous slice of the table, and the secondary key keeps
+    # every partition internally ordered so min/max statistics prune well.
+    sort_keys = [("STREAM_ID", "ascending")]
+    if sort_by is not None:
+        sort_keys.append((sort_by, "ascending"))
+    table = table.sort_by(sort_keys)
 
     print("    Writing PyArrow table to Parquet files...", end="", flush=True)
     st = time.time()
@@ -135,41 +229,50 @@ def create_hive_parquet(
         base_dir=output_dir,
         format=parquet_format,
         partitioning=partitioning,
+        file_options=parquet_format.make_write_options(
+            write_statistics=True,
+            compression="zstd",
+        ),
         existing_data_behavior="overwrite_or_ignore",
         max_rows_per_file=5_000_000,
+        min_rows_per_group=100_000,
         max_rows_per_group=250_000,
-        use_threads=False,
-        max_open_files=32,
+        use_threads=True,
+        # keep the sorted row order so each partition is written in one
+        # contiguous run, ordered by sort_by, for min/max pruning.
+        preserve_order=True,
+        # leave plenty of headroom under the default ulimit (256 on macOS)
+        # for the other descriptors the process holds.
+        max_open_files=128,
     )
     print(f"done [elapsed time: {time.time() - st:.2f} seconds]")
 
 
 # process metadata file. we will create a parquet file for the
-# metadata and also a shapefile for the gauge locations.
-# the shapefile will be used in the dashboard to display
+# metadata and also a GeoParquet file for the gauge locations.
+# the GeoParquet file will be used in the dashboard to display
 # the gauge locations on a map.
 print("Processing metadata...", end="", flush=True)
 df = pandas.read_csv(f"{input_data_dir}/01_metadata/metadata.csv")
 outfile = output_data_dir / "metadata.parquet"
 df.to_parquet(outfile, index=False)
 
-gdf = geopandas.GeoDataFrame(
-    df,
-    geometry=geopandas.points_from_xy(df["longitude_wgs84"], df["latitude_wgs84"]),
-    crs="EPSG:4326",  # WGS 84
-)
-
-gdf = gdf.rename(
+# rename and drop columns in a single pass, then attach the point
+# geometries built in one vectorized shapely call.
+gauges = df.rename(
     columns={
         "latitude_wgs84": "latitude",
         "longitude_wgs84": "longitude",
         "drainagearea_sqkm": "drain_sqkm",
     }
+).drop(columns=["WQ_parameters"], errors="ignore")
+
+points = shapely.points(gauges["longitude"].to_numpy(), gauges["latitude"].to_numpy())
+gdf = geopandas.GeoDataFrame(
+    gauges,
+    geometry=geopandas.GeoSeries(points, index=gauges.index, crs="EPSG:4326"),  # WGS 84
 )
-if "WQ_parameters" in gdf.columns:
-    gdf.drop(columns=["WQ_parameters"], inplace=True)
 
-gdf.to_file(f"{output_data_dir}/gauges.shp")
 gdf.to_parquet(f"{output_data_dir}/gauges.parquet")
 print("done")
 
@@ -1,21 +1,42 @@
 #!/usr/bin/env python3
 
+import argparse
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
+import geopandas as gpd
+import pyarrow.parquet as pq
 from tqdm import tqdm
 import requests
-
-
-def build_wc_var_availability_df(df):
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# shared session so connections to Geoconnex are pooled and kept alive
+# across requests and worker threads.
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=32,
+        max_retries=Retry(total=5, backoff_factor=0.3),
+    ),
+)
+
+# equal-area CRS (CONUS Albers, meters) used for nearest-feature joins
+PROJECTED_CRS = "EPSG:5070"
+
+
+def build_wc_var_availability_df(parquet_path):
     """
-    Build water-quality variable availability by gage as a wide boolean table.
+    Build water-quality variable availability by gage as a wide table of record counts.
 
     Returns
     -------
     pandas.DataFrame
         Columns:
         - STREAM_ID
-        - one column per variable (True/False)
+        - one <variable>_count column per variable
     """
 
     cols = [
@@ -33,17 +54,20 @@ def build_wc_var_availability_df(df):
         # Q?
     ]
 
-    # subset the data to only inlude the variable columns above.
-    df = df[cols]
+    # read only the variable columns above.
+    table = pq.read_table(parquet_path, columns=cols)
 
-    # count the number of records for each variable by gage.
-    counts = df.groupby("STREAM_ID").count()
+    # count the number of non-null records for each variable by gage. Arrow
+    # names the output columns <variable>_count.
+    counts = table.group_by("STREAM_ID").aggregate(
+        [(c, "count") for c in cols if c != "STREAM_ID"]
+    )
 
-    return counts
+    return counts.to_pandas()
 
 
 def call_geoconnex(url):
-    req = requests.get(url)
+    req = _SESSION.get(url)
 
     # if a non-200 code is returned, skip the site.
     if req.status_code != 200:
@@ -53,6 +77,115 @@ def call_geoconnex(url):
     return req.json()
 
 
+def query_geoconnex(
+    lat,
+    lon,
+    service,
+    buffer,
+    buffer_increment,
+    retries,
+    base_url,
+    output_format,
+):
+    # build a bounding box that surrounds the lat/lon using the format
+    # min_lon, min_lat, max_lon, max_lat. Buffer these points.
+    bbox = f"{lon-buffer},{lat-buffer},{lon+buffer},{lat+buffer}"
+
+    url = f"{base_url}/{service}/items?f={output_format}&bbox={bbox}"
+
+    res = call_geoconnex(url)
+
+    if res["numberReturned"] == 0:
+        retry = 1
+        while retry <= retries:
+            retry += 1
+
+            bbox = f"{lon-(buffer + retry*buffer_increment)},{lat-(buffer + retry*buffer_increment)},{lon+(buffer + retry*buffer_increment)},{lat+ (buffer + retry*buffer_increment)}"
+            url = f"{base_url}/{service}/items?f={output_format}&bbox={bbox}"
+            res = call_geoconnex(url)
+
+            if res["numberReturned"] > 0:
+                break
+
+    return res
+
+
+def load_geoconnex_collection(
+    service,
+    cache_dir,
+    base_url="https://reference.geoconnex.us/collections",
+    limit=10000,
+):
+    # download the full collection once and keep it on disk so that
+    # subsequent runs only read the local copy.
+    cache_file = Path(cache_dir) / f"{service}.parquet"
+    if not cache_file.exists():
+        features = []
+        number_matched = None
+        url = f"{base_url}/{service}/items?f=json&limit={limit}"
+        with tqdm(desc=f"Downloading Geoconnex {service}") as pbar:
+            while url is not None:
+                res = call_geoconnex(url)
+                features.extend(res["features"])
+                number_matched = res.get("numberMatched", number_matched)
+                pbar.total = number_matched
+                pbar.update(len(res["features"]))
+
+                # the server may cap the page size, so follow the next links
+                # until the whole collection has been returned.
+                url = next(
+                    (
+                        link["href"]
+                        for link in res.get("links", [])
+                        if link.get("rel") == "next"
+                    ),
+                    None,
+                )
+                if not res["features"]:
+                    break
+
+        # never cache a partial collection, a truncated copy would silently
+        # give the wrong nearest feature on every later run.
+        if number_matched is None or len(features) < number_matched:
+            raise RuntimeError(
+                f"Downloaded {len(features)} of {number_matched} {service} features."
+            )
+
+        collection = gpd.GeoDataFrame.from_features(features, crs="EPSG:4326")
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        collection.to_parquet(cache_file)
+
+    return gpd.read_parquet(cache_file)
+
+
+def join_geoconnex_metadata(df, collection, result_key, max_distance):
+    gauges = gpd.GeoDataFrame(
+        df[["STREAM_ID"]],
+        geometry=gpd.points_from_xy(df["longitude_wgs84"], df["latitude_wgs84"]),
+        crs="EPSG:4326",
+    ).to_crs(PROJECTED_CRS)
+    collection = collection[[result_key, "geometry"]].to_crs(PROJECTED_CRS)
+
+    # gauges farther than max_distance (meters) from every feature get no
+    # match, the same as when the widening bbox query returns nothing.
+    joined = gpd.sjoin_nearest(
+        gauges, collection, how="left", max_distance=max_distance
+    )
+
+    # a gauge that is equidistant to several features (e.g. on a shared
+    # boundary) is returned once per feature, keep the first match.
+    joined = joined[~joined.index.duplicated(keep="first")]
+
+    missing = joined[result_key].isna()
+    attributes = joined.loc[~missing, result_key].to_dict()
+    errors = {
+        stream_id: f"Gauge {stream_id} returned 0 features."
+        for stream_id in joined.loc[missing, "STREAM_ID"]
+    }
+
+    return attributes, errors
+
+
 def get_geoconnex_metadata(
     df,
     service="hu06",
@@ -62,51 +195,77 @@ def get_geoconnex_metadata(
     retries=5,
     base_url="https://reference.geoconnex.us/collections",
     output_format="json",
+    max_workers=32,
+    cache_dir=None,
 ):
+    # prefer a local spatial join against a cached copy of the collection,
+    # and only fall back to querying Geoconnex for every gauge if that fails.
+    if cache_dir is not None:
+        try:
+            collection = load_geoconnex_collection(service, cache_dir, base_url)
+
+            # match the furthest extent of the widening bbox query,
+            # converted from degrees to meters.
+            max_distance = (buffer + (retries + 1) * buffer_increment) * 111_000
+            return join_geoconnex_metadata(df, collection, result_key, max_distance)
+        except Exception as e:
+            print(
+                f"Unable to use local {service} collection, querying Geoconnex instead: {e}"
+            )
+
     attributes = {}
     errors = {}
 
-    for idx, row in tqdm(
-        df.iterrows(), total=len(df), desc=f"Querying Geoconnex {service}"
-    ):
-
-        lat = row.latitude_wgs84
-        lon = row.longitude_wgs84
-
-        # build a bounding box that surrounds the lat/lon using the format
-        # min_lon, min_lat, max_lon, max_lat. Buffer these points.
-        bbox = f"{lon-buffer},{lat-buffer},{lon+buffer},{lat+buffer}"
-
-        url = f"{base_url}/{service}/items?f={output_format}&bbox={bbox}"
-
-        res = call_geoconnex(url)
-
-        if res["numberReturned"] == 0:
-            retry = 1
-            while retry <= retries:
-                retry += 1
-                lat = row.latitude_wgs84
-                lon = row.longitude_wgs84
-
-                bbox = f"{lon-(buffer + retry*buffer_increment)},{lat-(buffer + retry*buffer_increment)},{lon+(buffer + retry*buffer_increment)},{lat+ (buffer + retry*buffer_increment)}"
-                url = f"{base_url}/{service}/items?f={output_format}&bbox={bbox}"
-                res = call_geoconnex(url)
-
-                if res["numberReturned"] > 0:
-                    break
+    coords = df[["latitude_wgs84", "longitude_wgs84"]].to_numpy()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(
+            lambda coord: query_geoconnex(
+                coord[0],
+                coord[1],
+                service,
+                buffer,
+                buffer_increment,
+                retries,
+                base_url,
+                output_format,
+            ),
+            coords,
+        )
 
-        # if more than one object is returned, notify the user and then skip the site.
-        if res["numberReturned"] != 1:
-            msg = f'Gauge {row.STREAM_ID} returned {res["numberReturned"]} features.'
-            errors[row.STREAM_ID] = msg
-            continue
+        for idx, stream_id, res in tqdm(
+            zip(df.index, df.STREAM_ID, results),
+            total=len(df),
+            desc=f"Querying Geoconnex {service}",
+        ):
+            # if more than one object is returned, notify the user and then skip the site.
+            if res["numberReturned"] != 1:
+                msg = f'Gauge {stream_id} returned {res["numberReturned"]} features.'
+                errors[stream_id] = msg
+                continue
 
-        attributes[idx] = res["features"][0]["properties"][result_key]
+            attributes[idx] = res["features"][0]["properties"][result_key]
 
     return attributes, errors
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build value-added attributes for the STREAM gauges."
+    )
+    parser.add_argument(
+        "--checkpoint",
+        action="store_true",
+        help="write vaa.parquet after each Geoconnex query so progress survives a crash",
+    )
+    parser.add_argument(
+        "--geoconnex-cache",
+        type=Path,
+        default=None,
+        help="directory for cached Geoconnex collections; enables local spatial joins",
+    )
+    args = parser.parse_args()
+
     parquet_dir = Path("processed-data/MRB")
 
     metadata_df = pd.read_parquet(parquet_dir / "metadata.parquet")
@@ -114,29 +273,31 @@ if __name__ == "__main__":
     vaa = metadata_df[["STREAM_ID", "state_name", "drainagearea_sqkm"]]
 
     # add HUCs
-    attribs, errors = get_geoconnex_metadata(metadata_df, "hu12", "huc12")
-    vaa["huc12"] = vaa.index.map(attribs)
-    vaa["huc10"] = vaa.index.map({k: v[0:10] for k, v in attribs.items()})
-    vaa["huc08"] = vaa.index.map({k: v[0:8] for k, v in attribs.items()})
-    vaa["huc06"] = vaa.index.map({k: v[0:6] for k, v in attribs.items()})
-    vaa["huc04"] = vaa.index.map({k: v[0:4] for k, v in attribs.items()})
-    vaa["huc02"] = vaa.index.map({k: v[0:2] for k, v in attribs.items()})
-    vaa.to_parquet(parquet_dir / "vaa.parquet")
+    attribs, errors = get_geoconnex_metadata(
+        metadata_df, "hu12", "huc12", cache_dir=args.geoconnex_cache
+    )
+    hucs = pd.Series(attribs, dtype=object)
+    vaa["huc12"] = vaa.index.map(hucs)
+    for n in (10, 8, 6, 4, 2):
+        vaa[f"huc{n:02d}"] = vaa.index.map(hucs.str.slice(0, n))
+    if args.checkpoint:
+        vaa.to_parquet(parquet_dir / "vaa.parquet")
 
     # add nhd comids
     if "nhdv2_comid" not in metadata_df.columns:
         attribs, errors = get_geoconnex_metadata(
-            metadata_df, "mainstems", "head_nhdpv2_comid", buffer=0.0001, retries=10
+            metadata_df,
+            "mainstems",
+            "head_nhdpv2_comid",
+            buffer=0.0001,
+            retries=10,
+            cache_dir=args.geoconnex_cache,
         )
-        cleaned_attribs = {k: v.split("/")[-1] for k, v in attribs.items()}
-        vaa["nhdv2_comid"] = vaa.index.map(cleaned_attribs)
-        vaa.to_parquet(parquet_dir / "vaa.parquet")
-
-    wq_df = pd.read_parquet(Path(parquet_dir) / "water_quality.parquet")
-    df_counts = build_wc_var_availability_df(wq_df)
+        comids = pd.Series(attribs, dtype=object).str.rsplit("/", n=1).str[-1]
+        vaa["nhdv2_comid"] = vaa.index.map(comids)
+        if args.checkpoint:
+            vaa.to_parquet(parquet_dir / "vaa.parquet")
 
-    df_counts = df_counts.rename(
-        columns=lambda c: f"{c}_count" if c != "STREAM_ID" else c
-    )
+    df_counts = build_wc_var_availability_df(parquet_dir / "water_quality.parquet")
     vaa = vaa.merge(df_counts, on="STREAM_ID", how="left")
     vaa.to_parquet(parquet_dir / "vaa.parquet")
@@ -1,7 +1,8 @@
 from datetime import datetime, timezone
 
+import orjson
 from fastapi import APIRouter, Header, HTTPException, Query
-from fastapi.responses import StreamingResponse
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
 
 from app.services.streams_service import StreamsError, StreamsService
@@ -9,6 +10,9 @@ from app.services.streams_service import StreamsError, StreamsService
 router = APIRouter()
 streams_service = StreamsService()
 
+# The options only depend on module constants, so encode them once at import.
+_OPTIONS_BYTES = orjson.dumps(streams_service.get_options())
+
 
 class StreamsLoginRequest(BaseModel):
     username: str = Field(..., min_length=1)
@@ -52,7 +56,7 @@ async def streams_logout(x_streams_session: str | None = Header(default=None)):
 
 @router.get("/options")
 async def streams_options():
-    return streams_service.get_options()
+    return Response(_OPTIONS_BYTES, media_type="application/json")
 
 
 @router.get("/gauges")
@@ -61,7 +65,7 @@ async def streams_gauges(
     max_features: int = Query(5000, ge=1, le=50000),
 ):
     try:
-        return streams_service.get_gauges_geojson(x_streams_session, max_features=max_features)
+        return ORJSONResponse(streams_service.get_gauges_geojson(x_streams_session, max_features=max_features))
     except StreamsError as err:
         raise HTTPException(status_code=401, detail=str(err)) from err
     except Exception as err:
@@ -74,7 +78,7 @@ async def streams_download(payload: StreamsDownloadRequest, x_streams_session: s
         raise HTTPException(status_code=400, detail="end_date must be greater than or equal to start_date")
 
     try:
-        zip_bytes = streams_service.build_download_zip(
+        zip_stream = streams_service.iter_download_zip(
             token=x_streams_session,
             gauges=payload.gauges,
             start_date=payload.start_date.astimezone(timezone.utc),
@@ -88,7 +92,7 @@ async def streams_download(payload: StreamsDownloadRequest, x_streams_session: s
         raise HTTPException(status_code=500, detail=f"Failed to generate download: {err}") from err
 
     return StreamingResponse(
-        iter([zip_bytes]),
+        zip_stream,
         media_type="application/zip",
         headers={"Content-Disposition": 'attachment; filename="streams-data.zip"'},
     )
@@ -1,23 +1,42 @@
 from __future__ import annotations
 
+import threading
 import zipfile
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
-from io import BytesIO
-from typing import Any
+from http.cookiejar import DefaultCookiePolicy
+from io import RawIOBase
+from typing import Any, Iterator
 from uuid import uuid4
 
 import pandas as pd
 import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
 import pyarrow.parquet as pq
 import requests
 import s3fs
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 HYDROSHARE_S3_CREDENTIALS_URL = "https://www.hydroshare.org/hsapi/user/service/accounts/s3/"
 HYDROSHARE_S3_ENDPOINT_URL = "https://s3.hydroshare.org"
 
 SESSION_TTL_HOURS = 8
 
+DOWNLOAD_MAX_WORKERS = 16
+
+# Shared HTTP session so HydroShare calls reuse pooled TLS connections. Cookies are
+# blocked because the session is shared between users and auth is sent per request.
+_SESSION = requests.Session()
+_SESSION.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=Retry(total=5, backoff_factor=0.3)),
+)
+
 WATER_QUALITY_VARS: dict[str, list[str]] = {
     "Water Temperature": ["WTemp_C", "Flag_WTemp_C"],
     "Specific Conductance": ["SpC_uScm", "Flag_SpC_uScm"],
@@ -61,6 +80,25 @@ class StreamsError(Exception):
     pass
 
 
+class _ZipChunkWriter(RawIOBase):
+    """Unseekable sink for ZipFile that buffers written bytes until they are drained."""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
 @dataclass
 class StreamsSession:
     token: str
@@ -80,13 +118,15 @@ class StreamsSession:
 class StreamsService:
     def __init__(self):
         self._sessions: dict[str, StreamsSession] = {}
+        self._dataset_cache: dict[tuple[str, str], ds.Dataset] = {}
+        self._dataset_cache_lock = threading.Lock()
 
     def login(self, username: str, password: str) -> StreamsSession:
         # Sidecar-like conservative flow:
         # 1) GET service accounts
         # 2) If credentials are not directly present, POST once to create/get key+secret
         try:
-            response_get = requests.get(HYDROSHARE_S3_CREDENTIALS_URL, auth=(username, password), timeout=20)
+            response_get = _SESSION.get(HYDROSHARE_S3_CREDENTIALS_URL, auth=(username, password), timeout=20)
         except requests.RequestException as err:
             raise StreamsError(f"Unable to reach HydroShare: {err}") from err
 
@@ -103,7 +143,7 @@ class StreamsService:
             raise StreamsError(f"HydroShare authentication failed (status {response_get.status_code}).")
 
         try:
-            response_post = requests.post(HYDROSHARE_S3_CREDENTIALS_URL, auth=(username, password), timeout=20)
+            response_post = _SESSION.post(HYDROSHARE_S3_CREDENTIALS_URL, auth=(username, password), timeout=20)
         except requests.RequestException as err:
             raise StreamsError(f"Unable to reach HydroShare: {err}") from err
 
@@ -175,6 +215,7 @@ class StreamsService:
 
     def logout(self, token: str) -> None:
         self._sessions.pop(token, None)
+        self._clear_session_caches(token)
 
     def get_session(self, token: str) -> StreamsSession:
         if not token:
@@ -198,33 +239,31 @@ class StreamsService:
         fs = self._build_s3_filesystem(session)
 
         table = pq.read_table(DATASET_PATHS["gauges"], filesystem=fs)
-        gauges = table.to_pandas()
 
-        if "latitude" not in gauges.columns or "longitude" not in gauges.columns:
+        if "latitude" not in table.column_names or "longitude" not in table.column_names:
             raise StreamsError("Gauge dataset does not include latitude/longitude columns.")
 
         if max_features > 0:
-            gauges = gauges.head(max_features)
+            table = table.slice(0, max_features)
+
+        lons = pc.cast(table["longitude"], pa.float64()).to_pylist()
+        lats = pc.cast(table["latitude"], pa.float64()).to_pylist()
+
+        properties = table.drop_columns([c for c in ("latitude", "longitude", "geometry") if c in table.column_names])
+        records = self._serialize_columns(properties).to_pylist()
 
-        features = []
-        for _, row in gauges.iterrows():
-            properties = {
-                k: self._serialize_value(v) for k, v in row.items() if k not in {"latitude", "longitude", "geometry"}
+        features = [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [lon, lat]},
+                "properties": record,
             }
-            features.append(
-                {
-                    "type": "Feature",
-                    "geometry": {
-                        "type": "Point",
-                        "coordinates": [float(row["longitude"]), float(row["latitude"])],
-                    },
-                    "properties": properties,
-                }
-            )
+            for lon, lat, record in zip(lons, lats, records)
+        ]
 
         return {"type": "FeatureCollection", "features": features}
 
-    def build_download_zip(
+    def iter_download_zip(
         self,
         token: str,
         gauges: list[str],
@@ -232,7 +271,8 @@ class StreamsService:
         end_date: datetime,
         water_quality_variables: list[str],
         other_datasets: list[str],
-    ) -> bytes:
+    ) -> Iterator[bytes]:
+        # Validate everything up front so errors surface before the response starts streaming.
         session = self.get_session(token)
         fs = self._build_s3_filesystem(session)
 
@@ -242,65 +282,126 @@ class StreamsService:
                 raise StreamsError(f"Unknown water quality variable: {label}")
             selected_wq_columns.extend(WATER_QUALITY_VARS[label])
 
-        output = BytesIO()
-        with zipfile.ZipFile(output, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
-            for gauge in gauges:
-                if len(selected_wq_columns) > 1:
-                    wq_df = self._read_filtered_dataset(
-                        fs=fs,
-                        dataset_name="water_quality",
-                        gauge=gauge,
-                        start_date=start_date,
-                        end_date=end_date,
-                        columns=selected_wq_columns,
-                    )
-                    wq_filename = f"{self._build_output_filename(gauge, 'water_quality')}.csv"
-                    zf.writestr(wq_filename, wq_df.to_csv(index=False))
-
-                for dataset in other_datasets:
-                    if dataset not in OTHER_DATASETS:
-                        raise StreamsError(f"Unknown dataset selection: {dataset}")
-                    dataset_df = self._read_filtered_dataset(
-                        fs=fs,
-                        dataset_name=dataset,
-                        gauge=gauge,
-                        start_date=start_date,
-                        end_date=end_date,
-                    )
-                    out_filename = f"{self._build_output_filename(gauge, dataset)}.csv"
-                    zf.writestr(out_filename, dataset_df.to_csv(index=False))
-
-        output.seek(0)
-        return output.getvalue()
+        for dataset in other_datasets:
+            if dataset not in OTHER_DATASETS:
+                raise StreamsError(f"Unknown dataset selection: {dataset}")
+
+        # Open every selected dataset once on this thread, so the download workers
+        # share the discovered datasets instead of each listing S3 on a cold cache.
+        dataset_names = (["water_quality"] if len(selected_wq_columns) > 1 else []) + other_datasets
+        datasets = {name: self._get_dataset(session, fs, name) for name in dataset_names}
+
+        # Check the columns against the schemas too; once streaming starts a failed read
+        # can only truncate the archive instead of returning an error.
+        for name, dataset in datasets.items():
+            time_col = "DateTime" if name == "water_quality" else DATASET_TIME_COLUMNS[name]
+            required = selected_wq_columns if name == "water_quality" else [time_col]
+            missing = [col for col in ["gauge", *required] if col not in dataset.schema.names]
+            if missing:
+                raise StreamsError(f"Dataset {name} is missing columns: {', '.join(missing)}")
+
+        return self._generate_download_zip(
+            datasets=datasets,
+            gauges=gauges,
+            start_date=start_date,
+            end_date=end_date,
+            selected_wq_columns=selected_wq_columns,
+            other_datasets=other_datasets,
+        )
+
+    def _generate_download_zip(
+        self,
+        datasets: dict[str, ds.Dataset],
+        gauges: list[str],
+        start_date: datetime,
+        end_date: datetime,
+        selected_wq_columns: list[str],
+        other_datasets: list[str],
+    ) -> Iterator[bytes]:
+        tasks: list[tuple[str, str, list[str] | None]] = []
+        for gauge in gauges:
+            if len(selected_wq_columns) > 1:
+                tasks.append((gauge, "water_quality", selected_wq_columns))
+            for dataset in other_datasets:
+                tasks.append((gauge, dataset, None))
+
+        # S3 reads are latency bound, so issue them concurrently. Only this generator
+        # writes to the archive, so entries are added one at a time as reads complete.
+        # At most DOWNLOAD_MAX_WORKERS reads are in flight, and the next one is only
+        # submitted once a result has been written, so a slow client doesn't leave
+        # every finished table waiting in memory.
+        remaining = iter(tasks)
+        pending: dict[Future, tuple[str, str]] = {}
+        executor = ThreadPoolExecutor(max_workers=DOWNLOAD_MAX_WORKERS)
+
+        def submit_next() -> None:
+            task = next(remaining, None)
+            if task is None:
+                return
+            gauge, dataset, columns = task
+            future = executor.submit(
+                self._read_filtered_dataset,
+                dataset=datasets[dataset],
+                dataset_name=dataset,
+                gauge=gauge,
+                start_date=start_date,
+                end_date=end_date,
+                columns=columns,
+            )
+            pending[future] = (gauge, dataset)
+
+        try:
+            for _ in range(DOWNLOAD_MAX_WORKERS):
+                submit_next()
+
+            output = _ZipChunkWriter()
+            with zipfile.ZipFile(output, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        gauge, dataset = pending.pop(future)
+                        out_filename = f"{self._build_output_filename(gauge, dataset)}.csv"
+                        self._write_csv_entry(zf, out_filename, future.result())
+                        submit_next()
+                        yield output.drain()
+
+            # closing the archive writes the central directory
+            yield output.drain()
+        finally:
+            # don't keep reading from S3 if the client went away
+            executor.shutdown(wait=False, cancel_futures=True)
 
     def _read_filtered_dataset(
         self,
-        fs: s3fs.S3FileSystem,
+        dataset: ds.Dataset,
         dataset_name: str,
         gauge: str,
         start_date: datetime,
         end_date: datetime,
         columns: list[str] | None = None,
-    ) -> pd.DataFrame:
-        path = DATASET_PATHS[dataset_name]
-        filters = [("gauge", "=", gauge)]
-
+    ) -> pa.Table:
         if dataset_name == "water_quality":
             time_col = "DateTime"
         else:
             time_col = DATASET_TIME_COLUMNS[dataset_name]
 
         start_value, end_value = self._build_time_range(
-            fs=fs,
-            path=path,
+            schema=dataset.schema,
             time_col=time_col,
             start_date=start_date,
             end_date=end_date,
         )
 
-        filters.extend([(time_col, ">=", start_value), (time_col, "<=", end_value)])
-        table = pq.read_table(path, filesystem=fs, columns=columns, filters=filters)
-        return table.to_pandas()
+        expression = (
+            (ds.field("gauge") == gauge) & (ds.field(time_col) >= start_value) & (ds.field(time_col) <= end_value)
+        )
+        return dataset.to_table(columns=columns, filter=expression, use_threads=True)
+
+    @staticmethod
+    def _write_csv_entry(zf: zipfile.ZipFile, filename: str, table: pa.Table) -> None:
+        # force_zip64 because the entry size is not known before the CSV is encoded
+        with zf.open(filename, mode="w", force_zip64=True) as entry:
+            pacsv.write_csv(table, entry)
 
     def _build_s3_filesystem(self, session: StreamsSession) -> s3fs.S3FileSystem:
         return s3fs.S3FileSystem(
@@ -313,6 +414,24 @@ class StreamsService:
         expired_tokens = [token for token, session in self._sessions.items() if session.is_expired()]
         for token in expired_tokens:
             del self._sessions[token]
+            self._clear_session_caches(token)
+
+    def _clear_session_caches(self, token: str) -> None:
+        with self._dataset_cache_lock:
+            for key in [key for key in self._dataset_cache if key[0] == token]:
+                del self._dataset_cache[key]
+
+    def _get_dataset(self, session: StreamsSession, fs: s3fs.S3FileSystem, dataset_name: str) -> ds.Dataset:
+        # Discovery lists hive directories and reads the schema from S3, so do it once per session.
+        # The lock is not held during discovery, so one slow listing doesn't block other sessions.
+        key = (session.token, dataset_name)
+        with self._dataset_cache_lock:
+            dataset = self._dataset_cache.get(key)
+        if dataset is None:
+            dataset = ds.dataset(DATASET_PATHS[dataset_name], filesystem=fs, format="parquet", partitioning="hive")
+            with self._dataset_cache_lock:
+                dataset = self._dataset_cache.setdefault(key, dataset)
+        return dataset
 
     @staticmethod
     def _build_output_filename(gauge_label: str, variable_label: str) -> str:
@@ -321,23 +440,30 @@ class StreamsService:
         return f"{gauge_label}-{var_label}"
 
     @staticmethod
-    def _serialize_value(value: Any) -> Any:
-        if pd.isna(value):
-            return None
-        if isinstance(value, pd.Timestamp):
-            return value.isoformat()
-        return value
+    def _serialize_columns(table: pa.Table) -> pa.Table:
+        # Format timestamps once per column; nulls already become None in to_pylist().
+        # Output matches isoformat(): whole seconds and a "+HH:MM" offset for tz-aware columns.
+        for i, field in enumerate(table.schema):
+            if pa.types.is_timestamp(field.type):
+                # %S prints fractional seconds for sub-second units, so truncate to seconds first.
+                column = pc.cast(table.column(i), pa.timestamp("s", tz=field.type.tz), safe=False)
+                if field.type.tz:
+                    column = pc.strftime(column, format="%Y-%m-%dT%H:%M:%S%z")
+                    # %z prints "+0000"; insert the colon to get "+00:00".
+                    column = pc.replace_substring_regex(column, pattern=r"([+-]\d{2})(\d{2})$", replacement=r"\1:\2")
+                else:
+                    column = pc.strftime(column, format="%Y-%m-%dT%H:%M:%S")
+                table = table.set_column(i, field.name, column)
+        return table
 
     @staticmethod
     def _build_time_range(
-        fs: s3fs.S3FileSystem,
-        path: str,
+        schema: pa.Schema,
         time_col: str,
         start_date: datetime,
         end_date: datetime,
     ) -> tuple[Any, Any]:
         try:
-            schema = pq.ParquetFile(path, filesystem=fs).schema_arrow
             field = schema.field(time_col)
             dtype = field.type
         except Exception:
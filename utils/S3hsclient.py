@@ -14,6 +14,7 @@ import concurrent.futures
 
 import s3fs
 import xarray
+import pyarrow.fs as pafs
 from tqdm import tqdm
 from hsclient import HydroShare, Resource
 
@@ -90,6 +91,7 @@ class S3HydroShare(HydroShare):
     def __init__(self, **kwargs):
         self.s3_key = None
         self.s3_secret = None
+        self._arrow_fs = None
         
         self.username = kwargs.pop('username', None)
         self.password = kwargs.pop('password', None)
@@ -135,6 +137,23 @@ class S3HydroShare(HydroShare):
             return None
         else:
             return self._hs_session.s3 
+
+    def get_arrow_filesystem(self):
+        """
+        Returns a native PyArrow S3FileSystem for the HydroShare S3 backend.
+        Parquet reads through this filesystem stay in Arrow's C++ I/O layer
+        rather than calling back into Python through fsspec.
+        """
+        if self.anon:
+            print('Cannot return S3 filesystem for anonymous users')
+            return None
+
+        if self._arrow_fs is None:
+            self._arrow_fs = pafs.S3FileSystem(access_key=self.s3_key,
+                                               secret_key=self.s3_secret,
+                                               endpoint_override=f"s3.{self._hs_session.host.replace('www.','')}",
+                                               scheme='https')
+        return self._arrow_fs
         
     def sign_in(self) -> None:
         """
@@ -36,7 +36,10 @@ class Map():
                 center=(41., -77),
                 zoom=7,
                 scroll_wheel_zoom=True,
-                tap=False
+                tap=False,
+                # draw vector layers (e.g. gauge circle markers) on a canvas
+                # instead of one SVG element per feature.
+                prefer_canvas=True
             )
         
         m.add_layer(
@@ -95,18 +98,44 @@ class Map():
             )
         )
         
-        # turn off Jupyter context menu
+        # turn off Jupyter context menu. A MutationObserver disables it as
+        # soon as a map container is mounted, and the WeakSet on window makes
+        # sure each container only gets one listener across cells.
         display(Javascript("""
-            setTimeout(function() {
-                var mapElements = document.querySelectorAll('.leaflet-container');
-                mapElements.forEach(function(el) {
-                    el.addEventListener('contextmenu', function(e) {
-                        e.preventDefault();
-                        e.stopPropagation();
-                        return false;
+            (function() {
+                var handled = window.__streamsContextMenuMaps =
+                    window.__streamsContextMenuMaps || new WeakSet();
+
+                // returns the number of containers that were not handled yet
+                function disableAll() {
+                    var added = 0;
+                    document.querySelectorAll('.leaflet-container').forEach(function(el) {
+                        if (handled.has(el)) {
+                            return;
+                        }
+                        handled.add(el);
+                        added += 1;
+                        el.addEventListener('contextmenu', function(e) {
+                            e.preventDefault();
+                            e.stopPropagation();
+                            return false;
+                        });
                     });
+                    return added;
+                }
+
+                // the new map may already be mounted when this runs
+                if (disableAll() > 0) {
+                    return;
+                }
+
+                var observer = new MutationObserver(function() {
+                    if (disableAll() > 0) {
+                        observer.disconnect();
+                    }
                 });
-            }, 1000);
+                observer.observe(document.body, { childList: true, subtree: true });
+            })();
         """))
         
     def action_after_map_click(self):
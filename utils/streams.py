@@ -7,19 +7,26 @@ Description: This is a script to demonstrate how STREAMS data can be downloaded
 Author(s): Tony Castronova <acastronova@cuahsi.org>
 """
 
+import asyncio
 from datetime import datetime
 from pathlib import Path
+import concurrent.futures
+import functools
+import itertools
 
 import geopandas as gpd
+import numpy as np
 import pandas
 import ipyleaflet
 from ipyleaflet import WidgetControl, WMSLayer
 from ipywidgets import Layout, HTML
 from IPython.display import display
 import ipywidgets as widgets
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
 import pyarrow.parquet as pq
-import threading
 import requests
+import shapely
 from shapely.geometry import shape, Point
 
 from utils import S3hsclient as hsclient
@@ -53,12 +60,94 @@ hs_paths = {
     'vaa': 'tonycastronova/248ec0f13d6c4580b2faa66425cb58c3/data/contents/vaa.parquet',
 }
 
+# gauge attributes that are displayed in the right-click popup
+gauge_popup_columns = [
+    "site name",
+    "STREAM_ID",
+    "source",
+    "SourceID",
+    "latitude",
+    "longitude",
+    "State",
+    "State Code",
+    "drain_sqkm",
+]
+
+# zoom level of the XYZ tiles used to bucket gauges by location. Only the
+# gauges in tiles that intersect the current map view are rendered.
+GAUGE_TILE_ZOOM = 6
+
+# maximum number of concurrent S3 reads when downloading data. This is
+# capped to avoid being rate limited by the HydroShare S3 endpoint.
+DOWNLOAD_MAX_WORKERS = 16
+
+
+def lonlat_to_tile(lon, lat, zoom):
+    """
+    Computes the XYZ (web mercator) tile ids for arrays of coordinates.
+    The tile id is x * 2**zoom + y.
+    """
+    n = 2**zoom
+    lat_rad = np.radians(np.clip(lat, -85.0511, 85.0511))
+    x = np.floor((np.asarray(lon) + 180.0) / 360.0 * n)
+    y = np.floor((1.0 - np.arcsinh(np.tan(lat_rad)) / np.pi) / 2.0 * n)
+    x = np.clip(x, 0, n - 1).astype(np.int64)
+    y = np.clip(y, 0, n - 1).astype(np.int64)
+    return x * n + y
+
+
+def visible_tiles(bounds, zoom):
+    """
+    Returns the set of XYZ tile ids that intersect the map bounds,
+    given as ((south, west), (north, east)).
+    """
+    (south, west), (north, east) = bounds
+    n = 2**zoom
+
+    # the north-west corner has the smallest x/y and the south-east the largest
+    nw, se = lonlat_to_tile(np.array([west, east]), np.array([north, south]), zoom)
+    x_min, y_min = divmod(int(nw), n)
+    x_max, y_max = divmod(int(se), n)
+    return {x * n + y for x in range(x_min, x_max + 1) for y in range(y_min, y_max + 1)}
+
+
+def initial_view_bounds(center, zoom, size=1024):
+    """
+    Approximates the bounds of a map view of size x size pixels, used
+    before the browser has reported the actual bounds.
+    """
+    half = 360.0 / (256 * 2**zoom) * size / 2
+    lat, lon = center
+    return ((lat - half, lon - half), (lat + half, lon + half))
+
+
+@functools.lru_cache(maxsize=256)
+def build_output_filename(gauge_label, variable_label):
+    """
+    Builds the output file name (without extension) for a gauge/variable pair.
+    Cached since the same few labels are formatted on every submit.
+    """
+    var_label = variable_label.replace("/", "-").replace(" ", "-").lower()
+    gage_label = "-".join(gauge_label.split("-")[1:])
+    return f"{gage_label}-{var_label}"
+
 
 class StreamsMap(leaflet_map.Map):
     def __init__(self, **kwargs):
 
         self.hs = hsclient.S3HydroShare(**kwargs)
 
+        # reuse a single filesystem handle and the opened datasets (footers,
+        # schemas and file listings) across all reads from this map.
+        self._fs = self.hs.get_arrow_filesystem()
+        self._datasets = {}
+
+        # start reading the gauges right away so the S3 request overlaps with
+        # the HUC6 read and the widget setup below.
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        gauges_future = executor.submit(self.read_gauges)
+        executor.shutdown(wait=False)
+
         # initialize the parent class
         super().__init__()
 
@@ -67,11 +156,14 @@ class StreamsMap(leaflet_map.Map):
         # track if the user click a gauge during the current event
         self.feature_selected = False
 
+        # timer that closes the gauge popup after a right-click
+        self._hover_timer = None
+
 
         # HUC 6 Boundaries - Add a WMS layer
         self.huc6 = gpd.read_parquet(
             hs_paths["HUC6"],
-            filesystem=self.hs.get_s3_filesystem(),
+            filesystem=self._fs,
         )
         huc6 = ipyleaflet.GeoData(
             geo_dataframe=self.huc6,
@@ -91,34 +183,40 @@ class StreamsMap(leaflet_map.Map):
 
         
         # STREAMS Gauges
-        self.gauges = gpd.read_parquet(
-            hs_paths["gauges"],
-            filesystem=self.hs.get_s3_filesystem(),
+        self.gauges = gauges_future.result()
+
+        # keep the gauge coordinates as contiguous arrays so the tile and
+        # nearest-gauge lookups work on NumPy data without pandas indexing.
+        self._lat_arr = np.ascontiguousarray(
+            self.gauges["latitude"].to_numpy(dtype=np.float64)
         )
-        geo_data = ipyleaflet.GeoData(
-            geo_dataframe=self.gauges,
-            style={
-                "color": "black",
-                "radius": 8,
-                "fillColor": "#3366cc",
-                "opacity": 0.5,
-                "weight": 1.9,
-                "dashArray": "2",
-                "fillOpacity": 0.6,
-            },
-            hover_style={"fillColor": "red", "fillOpacity": 0.2},
-            point_style={
-                "radius": 5,
-                "color": "red",
-                "fillOpacity": 0.8,
-                "fillColor": "blue",
-                "weight": 3,
-            },
-            name="Gauges",
+        self._lon_arr = np.ascontiguousarray(
+            self.gauges["longitude"].to_numpy(dtype=np.float64)
+        )
+
+        # only the gauges in the tiles covering the current view are sent to
+        # the browser. The layer is rebuilt when the set of visible tiles changes.
+        self._gauge_tiles = lonlat_to_tile(
+            self._lon_arr, self._lat_arr, GAUGE_TILE_ZOOM
+        )
+        self._visible_gauge_tiles = None
+        self.gauges_layer = None
+        self._update_gauges_layer(initial_view_bounds(self.map.center, self.map.zoom))
+        self.map.observe(self._on_map_bounds_change, names="bounds")
+
+        # build the gauge spatial index once so that right-click lookups
+        # are a tree query instead of a scan over every gauge.
+        self._gauge_index = shapely.STRtree(
+            shapely.points(self._lon_arr, self._lat_arr)
         )
-        geo_data.on_click(self.on_gauge_click)
 
-        self.map.add(geo_data)
+        # keep the popup fields as plain NumPy arrays so a right-click
+        # doesn't need to box a pandas row.
+        self._gauge_columns = {
+            col: self.gauges[col].to_numpy()
+            for col in gauge_popup_columns
+            if col in self.gauges.columns
+        }
 
 
 
@@ -193,46 +291,35 @@ class StreamsMap(leaflet_map.Map):
         date_accordion.set_title(0, "Date Range")
         date_accordion.layout.width = "99%"
 
-        # build water quality checkboxes
-        self.water_temp = self.build_checkbox("Water Temperature")
-        self.specific_conductance = self.build_checkbox("Specific Conductance")
-        self.do = self.build_checkbox("Dissolved Oxygen")
-        self.ph = self.build_checkbox("pH")
-        self.turbidity = self.build_checkbox("Turbidity")
-        self.no3 = self.build_checkbox("NO3")
-        self.fdom = self.build_checkbox("fDOM")
-        self.chla = self.build_checkbox("Chla")
-        self.pc = self.build_checkbox("PC")
-
-        water_quality_group = widgets.VBox(
-            [
-                widgets.HBox([self.water_temp, self.specific_conductance]),
-                widgets.HBox([self.do, self.ph]),
-                widgets.HBox([self.turbidity, self.no3]),
-                widgets.HBox([self.fdom, self.chla]),
-                widgets.HBox([self.pc]),
-            ]
-        )
+        # the checkboxes are only built the first time their accordion is
+        # expanded, so constructing the map doesn't wait on widgets that may
+        # never be shown.
+        water_quality_group = widgets.VBox()
         water_quality_accordion = widgets.Accordion(children=[water_quality_group])
         water_quality_accordion.set_title(0, "Water Quality Variables")
         water_quality_accordion.layout.width = "99%"
+        water_quality_accordion.observe(
+            functools.partial(
+                self._on_lazy_accordion_open,
+                group=water_quality_group,
+                build=self._build_water_quality_rows,
+            ),
+            names="selected_index",
+        )
 
         # add checkboxes for other types of data
-        self.streamflow = self.build_checkbox("Streamflow")
-        self.lulc = self.build_checkbox("Land Use/Cover")
-        self.grab = self.build_checkbox("Grab Samples")
-        self.anthro = self.build_checkbox("Anthropogenic")
-        self.historical_met = self.build_checkbox("Historical Meteorology")
-        other_variables_group = widgets.VBox(
-            [
-                widgets.HBox([self.streamflow, self.grab]),
-                widgets.HBox([self.lulc, self.anthro]),
-                widgets.HBox([self.historical_met]),
-            ]
-        )
+        other_variables_group = widgets.VBox()
         other_variables_accordion = widgets.Accordion(children=[other_variables_group])
         other_variables_accordion.set_title(0, "Other Variables")
         other_variables_accordion.layout.width = "99%"
+        other_variables_accordion.observe(
+            functools.partial(
+                self._on_lazy_accordion_open,
+                group=other_variables_group,
+                build=self._build_other_variables_rows,
+            ),
+            names="selected_index",
+        )
 
         # save the accordion components so they can
         # be referenced in event handlers later
@@ -248,8 +335,169 @@ class StreamsMap(leaflet_map.Map):
             self.accordions, layout=widgets.Layout(width="350px", overflow="hidden")
         )
 
-        # save all the checkboxes for easy lookup later
-        self.wc_checkboxes = [
+        self.map.add(WidgetControl(widget=self.options_widgets, position="bottomleft"))
+
+        # add a handler for when the map is clicked
+        # this is used to activate/deactivate the
+        # download button.
+        self.map.on_interaction(self.on_map_click)
+
+    def read_gauges(self):
+        """
+        Reads the gauges GeoParquet file with pyarrow and decodes all of the
+        WKB geometries in a single vectorized call. Only the geometry and the
+        popup attributes are loaded.
+        """
+        # only read the columns needed to draw, identify and describe the
+        # gauges. Columns missing from the file are skipped.
+        gauges_file = pq.ParquetFile(hs_paths["gauges"], filesystem=self._fs)
+        columns = [
+            col
+            for col in ["geometry", *gauge_popup_columns]
+            if col in gauges_file.schema_arrow.names
+        ]
+        table = gauges_file.read(columns=columns)
+        geometry = gpd.GeoSeries.from_wkb(
+            table.column("geometry").to_numpy(zero_copy_only=False),
+            crs="EPSG:4326",
+        )
+        return gpd.GeoDataFrame(
+            table.drop_columns(["geometry"]).to_pandas(), geometry=geometry
+        )
+
+    def _on_map_bounds_change(self, change):
+        # bounds are empty until the map has been rendered
+        if change["new"]:
+            self._update_gauges_layer(change["new"])
+
+    def _update_gauges_layer(self, bounds):
+        tiles = visible_tiles(bounds, GAUGE_TILE_ZOOM)
+        if tiles == self._visible_gauge_tiles:
+            return
+        self._visible_gauge_tiles = tiles
+
+        geo_data = ipyleaflet.GeoData(
+            geo_dataframe=self.gauges[np.isin(self._gauge_tiles, list(tiles))],
+            style={
+                "color": "black",
+                "radius": 8,
+                "fillColor": "#3366cc",
+                "opacity": 0.5,
+                "weight": 1.9,
+                "dashArray": "2",
+                "fillOpacity": 0.6,
+            },
+            hover_style={"fillColor": "red", "fillOpacity": 0.2},
+            point_style={
+                "radius": 5,
+                "color": "red",
+                "fillOpacity": 0.8,
+                "fillColor": "blue",
+                "weight": 3,
+            },
+            name="Gauges",
+        )
+        geo_data.on_click(self.on_gauge_click)
+
+        # swap the layer in place so that it keeps its position in the layer stack
+        if self.gauges_layer is None:
+            self.map.add(geo_data)
+        else:
+            self.map.substitute(self.gauges_layer, geo_data)
+            # release the replaced widget and its GeoJSON copy in the kernel
+            # and the browser, otherwise every tile change leaks a layer.
+            self.gauges_layer.close()
+        self.gauges_layer = geo_data
+
+    def get_dataset(self, name):
+        """
+        Returns the pyarrow dataset for one of the hs_paths entries. Datasets
+        are opened once and cached so that later reads don't need to fetch
+        the parquet footers or list hive partitions again.
+        """
+        if name not in self._datasets:
+            self._datasets[name] = ds.dataset(
+                hs_paths[name],
+                filesystem=self._fs,
+                format="parquet",
+                partitioning="hive",
+            )
+        return self._datasets[name]
+
+    def build_checkbox(
+        self, description, value=False, indent=False, layout=Layout(width="50%")
+    ):
+        return widgets.Checkbox(
+            description=description, value=value, indent=indent, layout=layout
+        )
+
+    def _on_lazy_accordion_open(self, change, group, build):
+        # fill the accordion the first time it is expanded
+        if change["new"] is not None and not group.children:
+            group.children = build()
+
+    # water quality checkboxes
+    @functools.cached_property
+    def water_temp(self):
+        return self.build_checkbox("Water Temperature")
+
+    @functools.cached_property
+    def specific_conductance(self):
+        return self.build_checkbox("Specific Conductance")
+
+    @functools.cached_property
+    def do(self):
+        return self.build_checkbox("Dissolved Oxygen")
+
+    @functools.cached_property
+    def ph(self):
+        return self.build_checkbox("pH")
+
+    @functools.cached_property
+    def turbidity(self):
+        return self.build_checkbox("Turbidity")
+
+    @functools.cached_property
+    def no3(self):
+        return self.build_checkbox("NO3")
+
+    @functools.cached_property
+    def fdom(self):
+        return self.build_checkbox("fDOM")
+
+    @functools.cached_property
+    def chla(self):
+        return self.build_checkbox("Chla")
+
+    @functools.cached_property
+    def pc(self):
+        return self.build_checkbox("PC")
+
+    # checkboxes for other types of data
+    @functools.cached_property
+    def streamflow(self):
+        return self.build_checkbox("Streamflow")
+
+    @functools.cached_property
+    def lulc(self):
+        return self.build_checkbox("Land Use/Cover")
+
+    @functools.cached_property
+    def grab(self):
+        return self.build_checkbox("Grab Samples")
+
+    @functools.cached_property
+    def anthro(self):
+        return self.build_checkbox("Anthropogenic")
+
+    @functools.cached_property
+    def historical_met(self):
+        return self.build_checkbox("Historical Meteorology")
+
+    # all the checkboxes for easy lookup later
+    @property
+    def wc_checkboxes(self):
+        return [
             self.water_temp,
             self.specific_conductance,
             self.do,
@@ -260,7 +508,10 @@ class StreamsMap(leaflet_map.Map):
             self.chla,
             self.pc,
         ]
-        self.other_checkboxes = [
+
+    @property
+    def other_checkboxes(self):
+        return [
             self.streamflow,
             self.lulc,
             self.grab,
@@ -268,19 +519,21 @@ class StreamsMap(leaflet_map.Map):
             self.historical_met,
         ]
 
-        self.map.add(WidgetControl(widget=self.options_widgets, position="bottomleft"))
-
-        # add a handler for when the map is clicked
-        # this is used to activate/deactivate the
-        # download button.
-        self.map.on_interaction(self.on_map_click)
+    def _build_water_quality_rows(self):
+        return [
+            widgets.HBox([self.water_temp, self.specific_conductance]),
+            widgets.HBox([self.do, self.ph]),
+            widgets.HBox([self.turbidity, self.no3]),
+            widgets.HBox([self.fdom, self.chla]),
+            widgets.HBox([self.pc]),
+        ]
 
-    def build_checkbox(
-        self, description, value=False, indent=False, layout=Layout(width="50%")
-    ):
-        return widgets.Checkbox(
-            description=description, value=value, indent=indent, layout=layout
-        )
+    def _build_other_variables_rows(self):
+        return [
+            widgets.HBox([self.streamflow, self.grab]),
+            widgets.HBox([self.lulc, self.anthro]),
+            widgets.HBox([self.historical_met]),
+        ]
 
     def on_map_click(self, **kwargs):
 
@@ -346,11 +599,11 @@ class StreamsMap(leaflet_map.Map):
         huc_id = feature['properties']['HUC_6']
         dat = pandas.read_parquet(
                 hs_paths["Metadata"],
-                filesystem=self.hs.get_s3_filesystem(),
+                filesystem=self._fs,
             )
         vaa = pandas.read_parquet(
                 hs_paths["vaa"],
-                filesystem=self.hs.get_s3_filesystem(),
+                filesystem=self._fs,
             )
         dat = dat.merge(vaa, on='STREAM_ID', how='inner')
         
@@ -417,60 +670,59 @@ class StreamsMap(leaflet_map.Map):
 
     def on_gauge_right_click(self, click_lat, click_lon):
 
-        # Find the closest gauge to the right-click location
-        self.gauges['_dist'] = (
-            (self.gauges['latitude'] - click_lat) ** 2 +
-            (self.gauges['longitude'] - click_lon) ** 2
+        # Find the closest gauge to the right-click location using the
+        # spatial index rather than computing the distance to every gauge
+        (idx,), (dist,) = self._gauge_index.query_nearest(
+            Point(click_lon, click_lat), return_distance=True, all_matches=False
         )
-        closest = self.gauges.loc[self.gauges['_dist'].idxmin()]
     
         # Only show popup if click was close enough to a feature
-        if closest['_dist'] > 0.0001:  # tune this threshold
+        if dist > 0.01:  # tune this threshold
             return
     
-        props = closest.to_dict()
+        props = {col: values[idx] for col, values in self._gauge_columns.items()}
         lat = props.get('latitude')
         lon = props.get('longitude')
 
         # Create HTML content for the popup
-        html_content = "<div style='min-width: 200px;'>"
-        html_content += f"<h4>{props.get('site name', 'Gauge')}</h4>"
-        html_content += f"<b>Stream ID:</b> {props.get('STREAM_ID', 'N/A')}<br>"
-        html_content += f"<b>Source:</b> {props.get('source', 'N/A')} ({props.get('SourceID', 'N/A')})<br>"
-        html_content += f"<b>Location:</b> {props.get('latitude', 'N/A')}, {props.get('longitude', 'N/A')}<br>"
-        html_content += f"<b>State:</b> {props.get('State', 'N/A')} ({props.get('State Code', 'N/A')})<br>"
-        html_content += (
+        html_content = (
+            "<div style='min-width: 200px;'>"
+            f"<h4>{props.get('site name', 'Gauge')}</h4>"
+            f"<b>Stream ID:</b> {props.get('STREAM_ID', 'N/A')}<br>"
+            f"<b>Source:</b> {props.get('source', 'N/A')} ({props.get('SourceID', 'N/A')})<br>"
+            f"<b>Location:</b> {props.get('latitude', 'N/A')}, {props.get('longitude', 'N/A')}<br>"
+            f"<b>State:</b> {props.get('State', 'N/A')} ({props.get('State Code', 'N/A')})<br>"
             f"<b>Drainage Area:</b> {props.get('drain_sqkm', 'N/A')} km²<br>"
+            "</div>"
         )
-        html_content += "</div>"
 
         # Update popup
         self.popup.child = HTML(html_content)
         self.popup.location = [lat, lon]
 
-        # Add popup to map on first click
+        # Add popup to map on first click. On subsequent clicks reopen it
+        # explicitly, since the browser closes it on any map click or via
+        # its close button without the kernel knowing.
         if not self.popup_added:
             self.map.add(self.popup)  # or self.m.add(self.popup)
             self.popup_added = True
         else:
-            # Reopen the popup for subsequent clicks
-            self.map.remove(self.popup)
-            self.map.add(self.popup)
-        
-        # Schedule popup close after short delay
-        self._hover_timer = threading.Timer(3, self._close_popup)
-        self._hover_timer.start()
+            self.popup.open_popup([lat, lon])
+
+        # cancel the pending close from a previous click so that timers
+        # don't stack up and close the popup early
+        if self._hover_timer is not None:
+            self._hover_timer.cancel()
+
+        # Schedule popup close after short delay on the kernel's event loop,
+        # so the popup is only ever modified from the kernel thread
+        self._hover_timer = asyncio.get_event_loop().call_later(3, self._close_popup)
 
     def _close_popup(self):
         if self.popup_added:
             self.map.remove(self.popup)
             self.popup_added = False
             
-    def build_output_filename(self, gauge_label, variable_label):
-        var_label = variable_label.replace("/", "-").replace(" ", "-").lower()
-        gage_label = "-".join(gauge_label.split("-")[1:])
-        return f"{gage_label}-{var_label}"
-
     def on_submit_click(self, button):
 
         # Collapse all accordions and update button
@@ -492,56 +744,89 @@ class StreamsMap(leaflet_map.Map):
         st = self.start_date.value
         et = self.end_date.value
 
-        # identify water quality variables that should be saved
+        # identify the selected variables in a single pass over each group
         wc_vars = ["DateTime"]
-        for chk in self.wc_checkboxes:
-            if chk.value == True:
-                wc_vars.extend(water_quality_vars[chk.description])
-
-        for gauge in gauges:
-            # only download data if variables are selected
-            if len(wc_vars) > 1:
-                
-                table = pq.read_table(
-                    hs_paths["water_quality"],
-                    filesystem=self.hs.get_s3_filesystem(),
-                    columns=wc_vars,
-                    filters=[
-                        ("gauge", "=", gauge),
-                        ("DateTime", ">=", st),
-                        ("DateTime", "<=", et),
-                    ],
+        wc_vars.extend(
+            itertools.chain.from_iterable(
+                water_quality_vars[c.description]
+                for c in self.wc_checkboxes
+                if c.value
+            )
+        )
+        selected_other = [c for c in self.other_checkboxes if c.value]
+
+        # build the list of downloads up front so they can be run concurrently.
+        # each variable is read once for all selected gauges, so the parquet
+        # footers and shared row groups are only fetched once.
+        tasks = []
+
+        # only download data if variables are selected
+        if len(wc_vars) > 1:
+            tasks.append(
+                (
+                    "water_quality",
+                    # include the gauge column so the result can be split by gauge
+                    wc_vars + ["gauge"],
+                    (ds.field("gauge").isin(gauges))
+                    & (ds.field("DateTime") >= st)
+                    & (ds.field("DateTime") <= et),
                 )
-                subset = table.to_pandas()
-                out_filename = self.build_output_filename(gauge, "water_quality")
-                subset.to_csv(f"{str(outdir)}/{out_filename}.csv", index=False)
-
-            # download other variables
-            for chk in self.other_checkboxes:
-                if chk.value:
-                    if (chk.description == "Streamflow") or (
-                        chk.description == "Grab Samples"
-                    ):
-                        time_column = "DateTime"
-                    elif chk.description == "Historical Meteorology":
-                        time_column = "time"
-                    else:
-                        time_column = "year"
-
-                    
-                    table = pq.read_table(
-                        hs_paths[chk.description],
-                        filesystem=self.hs.get_s3_filesystem(),
-                        filters=[
-                            ("gauge", "=", gauge),
-                            (time_column, ">=", st),
-                            (time_column, "<=", et),
-                        ],
-                    )
-                    subset = table.to_pandas()
-
-                    out_filename = self.build_output_filename(gauge, chk.description)
-                    subset.to_csv(f"{str(outdir)}/{out_filename}.csv", index=False)
+            )
+
+        # download other variables
+        for chk in selected_other:
+            if (chk.description == "Streamflow") or (
+                chk.description == "Grab Samples"
+            ):
+                time_column = "DateTime"
+            elif chk.description == "Historical Meteorology":
+                time_column = "time"
+            else:
+                time_column = "year"
+
+            tasks.append(
+                (
+                    chk.description,
+                    None,
+                    (ds.field("gauge").isin(gauges))
+                    & (ds.field(time_column) >= st)
+                    & (ds.field(time_column) <= et),
+                )
+            )
+
+        # reads are bound by S3 latency and Arrow scans release the GIL,
+        # so run them in a thread pool that shares a single filesystem.
+        # each worker also writes its own csv files, so disk writes for one
+        # variable overlap with the S3 reads of the others.
+        def download(task):
+            variable, columns, filter_expr = task
+            # the expression filter lets the scan skip row groups using their
+            # statistics before any data is fetched.
+            table = self.get_dataset(variable).to_table(
+                columns=columns, filter=filter_expr
+            )
+
+            # split the combined result into one file per gauge
+            for gauge in gauges:
+                subset = table.filter(ds.field("gauge") == gauge)
+                if columns is not None:
+                    subset = subset.select(wc_vars)
+                out_filename = build_output_filename(gauge, variable)
+                pacsv.write_csv(subset, f"{str(outdir)}/{out_filename}.csv")
+            return variable
+
+        # nothing was selected, so skip spinning up the thread pool
+        if tasks:
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=DOWNLOAD_MAX_WORKERS
+            ) as executor:
+                futures = [executor.submit(download, task) for task in tasks]
+                for i, future in enumerate(
+                    concurrent.futures.as_completed(futures), start=1
+                ):
+                    # surface any read/write errors on the main thread
+                    future.result()
+                    self.submit.description = f"Downloading... ({i}/{len(tasks)})"
 
         # re-enable the submit button when download is complete
         self.submit.disabled = False